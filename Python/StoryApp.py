@@ -1,14 +1,19 @@
 #Conversation Helper Fie
 
-import spacy
+import functools
 import sqlite3
 
 class StoryApp:
     def __init__(self):
-        self.nlp = spacy.load("en_core_web_sm")  # Load NLP model
         self.conn = sqlite3.connect('story_db.sqlite')  # Connect to SQLite Database
         self.initialize_db()
 
+    @functools.cached_property
+    def nlp(self):
+        # Import and load NLP model on first use; entities and noun chunks need the tagger and parser but not the lemmatizer
+        import spacy
+        return spacy.load("en_core_web_sm", disable=["lemmatizer"])
+
     def initialize_db(self):
         # Create tables for story, characters, settings, etc.
         pass
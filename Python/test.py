@@ -6,51 +6,378 @@ to generate an image using DALL-E. It requires an OpenAI API key and uses a JSON
 for configuration.
 """
 
+import argparse
+import functools
+import hashlib
+import importlib.util
 import json
 import sqlite3
+from contextlib import closing
 import os
+from pathlib import Path
 import re
-import requests
-from openai import OpenAI
+import shutil
+from itertools import islice
+import tempfile
+import asyncio
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+# File paths, relative to STORYBOOK_DIR (default: this script's directory)
+BASE_DIR = Path(os.environ.get("STORYBOOK_DIR", Path(__file__).parent))
+CONFIG_PATH = BASE_DIR / "data.json"
+DB_PATH = BASE_DIR / "story_data.db"
+IMAGE_DIR = BASE_DIR / "Images"
+
+DEFAULT_MODEL = "gpt-3.5-turbo-1106"
+
+# Static instructions go in the system message so every request shares a cacheable prefix
+STORY_SYSTEM_PROMPT = "You craft short stories for children. Write a child appropriate story using the story type, setting and characters you are given."
+MAX_SUMMARY_INPUT = 2000
+SUMMARY_SYSTEM_PROMPT = ("You describe illustrations for children's stories. Images should be child appropriate. "
+                         "Summarize the text you are given. Encapsulate the essence of the story with a response no more than 800 characters.")
+
+# Cap on in-flight OpenAI requests and the errors worth retrying with backoff
+MAX_CONCURRENT_REQUESTS = 5
+SEM = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+def is_retryable_error(exception):
+    """
+    Check whether an OpenAI error is worth retrying with backoff.
+
+    Parameters:
+    exception (BaseException): The error raised by the request.
+
+    Returns:
+    bool: True for rate limit, connection, timeout and server errors.
+    """
+    import openai  # Already loaded by the client that raised the error
+    # APITimeoutError is a subclass of APIConnectionError
+    return isinstance(exception, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError))
+
+openai_retry = retry(
+    retry=retry_if_exception(is_retryable_error),
+    wait=wait_exponential_jitter(1, 30),
+    stop=stop_after_attempt(6),
+    reraise=True
+)
+
+# Regular expressions to identify key story elements, compiled once. They are kept separate
+# because the phrases overlap, e.g. a setting inside an action ("sitting in a chair")
+SETTING_PATTERN = re.compile(r"in a [^.,]+|on a [^.,]+|at the [^.,]+")
+CHARACTERS_PATTERN = re.compile(r"a [^.,]+ man|a [^.,]+ woman|a [^.,]+ person|a [^.,]+ creature")
+ACTION_PATTERN = re.compile(r"holding a [^.,]+|standing [^.,]+|sitting [^.,]+|lying [^.,]+")
+MAX_CHARACTERS = 10
+CHARACTER_SEPARATOR = re.compile(r",|\band\b|&")
+
+DOWNLOAD_BUFFER_SIZE = 1024 * 1024
+SAVE_BATCH_SIZE = 50
+
+# DALL-E generations in progress, keyed by image cache key
+DALLE_IN_FLIGHT = {}
+
+@functools.cache
+def get_download_client():
+    """
+    Get the shared keep-alive pool so repeat downloads skip the TCP and TLS handshakes.
+
+    Returns:
+    httpx.AsyncClient: The HTTP client used for image downloads.
+    """
+    import httpx
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=8, max_keepalive_connections=4),
+        timeout=30
+    )
+
+def parse_reset_duration(value):
+    """
+    Convert an OpenAI rate limit reset header (e.g. '6m0s', '1.5s', '20ms') to seconds.
+
+    Parameters:
+    value (str): The header value.
+
+    Returns:
+    float: The number of seconds until the limit resets.
+    """
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    return sum(float(amount) * units[unit] for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value or ""))
+
+async def wait_for_rate_limit(headers):
+    """
+    Sleep until the request limit resets if the last response used up the remaining quota.
+
+    Parameters:
+    headers (httpx.Headers): The headers of the last OpenAI response.
+    """
+    if headers.get("x-ratelimit-remaining-requests") == "0":
+        await asyncio.sleep(parse_reset_duration(headers.get("x-ratelimit-reset-requests")))
 
 def read_json_file(file_path):
     """
     Read data from a JSON file.
 
     Parameters:
-    file_path (str): The path to the JSON file to be read.
+    file_path (str or Path): The path to the JSON file to be read.
+
+    Returns:
+    dict: The data read from the JSON file. It is shared between calls, so do not modify it.
+    """
+    return _read_json_file(os.fspath(file_path), os.path.getmtime(file_path))
+
+@functools.lru_cache(maxsize=16)
+def _read_json_file(file_path, mtime):
+    # The modification time is part of the cache key so edited files are parsed again
+    with open(file_path, 'rb') as json_file:
+        return json_loads(json_file.read())
+
+def build_messages(prompt, system_prompt=None):
+    """
+    Build the chat messages for a prompt.
+
+    The system prompt comes first and must stay byte-identical across calls so
+    OpenAI's automatic prompt caching can reuse the shared prefix.
+
+    Parameters:
+    prompt (str): The user message.
+    system_prompt (str): The static instructions, or None to send only the user message.
+
+    Returns:
+    list: The messages for the chat completion.
+    """
+    messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+def create_openai_client(api_key):
+    """
+    Create the OpenAI client shared by every ChatGPT and DALL-E call.
+
+    The connection pool is sized to the request semaphore, and HTTP/2 is used when
+    the h2 package is installed so concurrent requests share one TLS connection.
+
+    Parameters:
+    api_key (str): The OpenAI API key.
+
+    Returns:
+    AsyncOpenAI: The OpenAI client instance.
+    """
+    import httpx
+    from openai import AsyncOpenAI
+
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=MAX_CONCURRENT_REQUESTS, max_keepalive_connections=MAX_CONCURRENT_REQUESTS),
+        http2=importlib.util.find_spec("h2") is not None,
+        timeout=60
+    )
+    # The SDK's own retries are turned off so openai_retry is the only retry layer
+    return AsyncOpenAI(api_key=api_key, http_client=http_client, max_retries=0)
+
+def prompt_cache_key(model, prompt, system_prompt=None):
+    """
+    Build the prompt cache key for a model, system prompt and prompt.
+
+    Parameters:
+    model (str): The model the prompt is sent to.
+    prompt (str): The prompt text.
+    system_prompt (str): The system prompt sent with it, if any.
+
+    Returns:
+    str: A BLAKE2b hex digest identifying the request.
+    """
+    return hashlib.blake2b("\x1f".join((model, system_prompt or "", prompt)).encode()).hexdigest()
+
+def get_cached_response(cursor, model, prompt, system_prompt=None):
+    """
+    Look up a cached ChatGPT response.
+
+    Parameters:
+    cursor (sqlite3.Cursor): The database cursor.
+    model (str): The model the prompt is sent to.
+    prompt (str): The prompt text.
+    system_prompt (str): The system prompt sent with it, if any.
+
+    Returns:
+    str: The cached response, or None on a cache miss.
+    """
+    key = prompt_cache_key(model, prompt, system_prompt)
+    row = cursor.execute("SELECT response FROM prompt_cache WHERE prompt_hash = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def cache_response(cursor, model, prompt, response, system_prompt=None):
+    """
+    Store a ChatGPT response in the prompt cache.
+
+    Parameters:
+    cursor (sqlite3.Cursor): The database cursor.
+    model (str): The model the prompt was sent to.
+    prompt (str): The prompt text.
+    response (str): The response from ChatGPT.
+    system_prompt (str): The system prompt sent with it, if any.
+    """
+    # Commit straight away so no write transaction stays open across the caller's awaits
+    with cursor.connection:
+        cursor.execute("""
+            INSERT OR IGNORE INTO prompt_cache (prompt_hash, model, response)
+            VALUES (?, ?, ?)
+        """, (prompt_cache_key(model, prompt, system_prompt), model, response))
+
+def split_characters(characters):
+    """
+    Split the user's character list into individual names.
+
+    Parameters:
+    characters (str): The characters as typed by the user, e.g. 'Alice, Bob and Carol'.
+
+    Returns:
+    list: The character names in the order given.
+    """
+    return [name.strip() for name in CHARACTER_SEPARATOR.split(characters) if name.strip()]
+
+def story_template_key(story_info):
+    """
+    Build the template cache key for a story request.
+
+    Parameters:
+    story_info (dict): The user's story preferences.
+
+    Returns:
+    tuple: The normalized story type, setting and number of characters.
+    """
+    return (story_info['story_type'].strip().lower(), story_info['setting'].strip().lower(),
+            len(split_characters(story_info['characters'])))
+
+def is_proper_name(name):
+    """
+    Check whether a character looks like a proper name, e.g. 'Alice' or 'Captain Hook'.
+
+    Parameters:
+    name (str): The character as typed by the user.
 
     Returns:
-    dict: The data read from the JSON file.
+    bool: True if every word of the name is capitalized.
     """
-    with open(file_path, 'r', encoding='utf-8') as json_file:
-        data = json.load(json_file)
-    return data
+    return all(word[:1].isupper() for word in name.split())
 
-def get_chatgpt_response(client, prompt, model="gpt-3.5-turbo-1106"):
+def is_templatable_name(name, text):
+    """
+    Check whether a character can be swapped out of a story by replacing its name.
+
+    Parameters:
+    name (str): The character as typed by the user.
+    text (str): The story text from ChatGPT.
+
+    Returns:
+    bool: True if the name is a proper name that appears in the text, and none of its
+    words appear anywhere else in any form ('Hook' alone, 'the captain').
+    """
+    if not is_proper_name(name):
+        return False
+    occurrences = len(re.findall(rf"\b{re.escape(name)}\b", text))
+    if not occurrences:
+        return False
+    words = name.split()
+    return all(len(re.findall(rf"\b{re.escape(word)}\b", text, re.IGNORECASE)) == occurrences * words.count(word)
+               for word in words)
+
+def get_templated_story(cursor, story_info):
+    """
+    Fill a cached story skeleton with this request's characters.
+
+    Parameters:
+    cursor (sqlite3.Cursor): The database cursor.
+    story_info (dict): The user's story preferences.
+
+    Returns:
+    str: The story with the characters substituted, or None on a cache miss or when
+    the characters are not proper names.
+    """
+    row = cursor.execute("""
+        SELECT template FROM story_template_cache
+        WHERE story_type = ? AND setting = ? AND character_count = ?
+    """, story_template_key(story_info)).fetchone()
+    names = split_characters(story_info['characters'])
+    if not row or not all(is_proper_name(name) for name in names):
+        return None
+    story = row[0]
+    for index, name in enumerate(names):
+        story = story.replace(f"{{CHAR_{index}}}", name)
+    return story
+
+def cache_story_template(cursor, story_info, text_response):
+    """
+    Store a story with its characters replaced by {CHAR_n} placeholders.
+
+    Only proper names are templated. Each name must be capitalized, appear in the story,
+    and be referred to only in that exact form, so a later fill can neither drop a
+    character nor leave the old ones behind (e.g. 'a princess' later called 'the princess').
+
+    Parameters:
+    cursor (sqlite3.Cursor): The database cursor.
+    story_info (dict): The user's story preferences.
+    text_response (str): The story text from ChatGPT.
+    """
+    names = split_characters(story_info['characters'])
+    placeholders = {name: f"{{CHAR_{index}}}" for index, name in enumerate(names)}
+    if not all(is_templatable_name(name, text_response) for name in names):
+        return
+    if names:
+        # Longest names first so 'Ann' cannot match inside 'Anna'
+        pattern = re.compile(r"\b(?:" + "|".join(re.escape(name) for name in sorted(placeholders, key=len, reverse=True)) + r")\b")
+        text_response = pattern.sub(lambda match: placeholders[match.group()], text_response)
+    with cursor.connection:
+        cursor.execute("""
+            INSERT OR IGNORE INTO story_template_cache (story_type, setting, character_count, template)
+            VALUES (?, ?, ?, ?)
+        """, story_template_key(story_info) + (text_response,))
+
+async def get_chatgpt_response(client, prompt, model=DEFAULT_MODEL, cursor=None, system_prompt=None):
     """
     Get a response from ChatGPT based on the given prompt.
 
     Parameters:
-    client (OpenAI): The OpenAI client instance.
+    client (AsyncOpenAI): The OpenAI client instance.
     prompt (str): The prompt to send to ChatGPT.
     model (str): The model to use for the chat completion (default is 'gpt-3.5-turbo-1106').
+    cursor (sqlite3.Cursor): The database cursor for the prompt cache, or None to bypass it.
+    system_prompt (str): Static instructions sent as the system message, if any.
 
     Returns:
     str: The content of the response from ChatGPT, or None if an error occurs.
     """
+    if cursor is not None:
+        cached = get_cached_response(cursor, model, prompt, system_prompt)
+        if cached:
+            return cached
+
     try:
-        response = client.chat.completions.create(
-            messages=[
-                {"role": "user", "content": prompt}
-            ],
-            model=model
-        )
-        return response.choices[0].message.content
+        response = await request_chat_completion(client, build_messages(prompt, system_prompt), model)
+        content = response.choices[0].message.content
     except Exception as e:
         print(f"Error in getting response from ChatGPT: {e}")
         return None
 
+    if cursor is not None and content:
+        cache_response(cursor, model, prompt, content, system_prompt)
+    return content
+
+@openai_retry
+async def request_chat_completion(client, messages, model):
+    """
+    Send a chat completion request, retrying transient errors with backoff.
+    """
+    async with SEM:
+        raw_response = await client.chat.completions.with_raw_response.create(
+            messages=messages,
+            model=model
+        )
+        await wait_for_rate_limit(raw_response.headers)
+    return raw_response.parse()
+
 
 def extract_image_instructions(text, max_length=500):
     """
@@ -63,51 +390,137 @@ def extract_image_instructions(text, max_length=500):
     Returns:
     str: A concise set of instructions for image generation.
     """
-    # Regular expressions to identify key story elements
-    setting_pattern = r"(in a [^\.,]+|on a [^\.,]+|at the [^\.,]+)"
-    characters_pattern = r"(a [^\.,]+ man|a [^\.,]+ woman|a [^\.,]+ person|a [^\.,]+ creature)"
-    action_pattern = r"(holding a [^\.,]+|standing [^\.,]+|sitting [^\.,]+|lying [^\.,]+)"
+    if not text:
+        return ""
 
     # Extract key elements
-    setting = re.search(setting_pattern, text)
-    characters = re.findall(characters_pattern, text)
-    action = re.search(action_pattern, text)
+    setting = SETTING_PATTERN.search(text)
+    characters = [match.group() for match in islice(CHARACTERS_PATTERN.finditer(text), MAX_CHARACTERS)]  # Limiting to 10 characters for brevity
+    action = ACTION_PATTERN.search(text)
 
     # Form the instruction string
-    instruction_parts = [setting.group() if setting else "", 
-                         ", ".join(characters[:]),  # Limiting to 10 characters for brevity
+    instruction_parts = [setting.group() if setting else "",
+                         ", ".join(characters),
                          action.group() if action else ""]
-    instruction = ", ".join(filter(None, instruction_parts))
-
+    instruction = ", ".join([part for part in instruction_parts if part])
 
     # Truncate if exceeds max length
-    if len(instruction) > max_length:
-        return instruction[:max_length].rsplit(' ', 1)[0]  # Avoid cutting off mid-word
-    return instruction
+    return truncate_text(instruction, max_length)
+
+def truncate_text(text, max_length):
+    """
+    Truncate text to a maximum length, cutting at the last space when there is one.
 
+    Parameters:
+    text (str): The text to truncate.
+    max_length (int): The maximum character length of the result.
 
-def create_dalle_image(client, text):
+    Returns:
+    str: The text, shortened if it exceeds max_length.
+    """
+    if len(text) <= max_length:
+        return text
+    cut = text.rfind(' ', 0, max_length)  # Avoid cutting off mid-word
+    return text[:cut] if cut > 0 else text[:max_length]
+
+
+async def create_dalle_image(client, text):
     """
     Create an image using DALL-E based on the text.
 
     Parameters:
-    client (OpenAI): The OpenAI client instance.
+    client (AsyncOpenAI): The OpenAI client instance.
     text (str): The text prompt to be used for generating the image.
 
     Returns:
     str: The URL of the generated image, or None if an error occurs.
     """
     try:
-        response = client.images.generate(
-            prompt=text,
-            n=1,
-            size="256x256"
-        )
+        response = await request_image_generation(client, text)
         return response.data[0].url
     except Exception as e:
         print(f"Error in creating image with DALL-E: {e}")
         return None
 
+@openai_retry
+async def request_image_generation(client, text):
+    """
+    Send an image generation request, retrying transient errors with backoff.
+    """
+    async with SEM:
+        raw_response = await client.images.with_raw_response.generate(
+            prompt=text,
+            n=1,
+            size="256x256"
+        )
+        await wait_for_rate_limit(raw_response.headers)
+    return raw_response.parse()
+
+async def get_dalle_image(client, text, image_dir, cursor=None):
+    """
+    Get a DALL-E image for the text, reusing the local copy of an earlier identical prompt.
+
+    Parameters:
+    client (AsyncOpenAI): The OpenAI client instance.
+    text (str): The text prompt to be used for generating the image.
+    image_dir (Path): The directory cached images are downloaded to.
+    cursor (sqlite3.Cursor): The database cursor for the image cache, or None to bypass it.
+
+    Returns:
+    tuple: The image URL and the path of a local copy, or None for either if unavailable.
+    """
+    if cursor is None:
+        return await create_dalle_image(client, text), None
+
+    key = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+    row = cursor.execute("SELECT url, local_path FROM dalle_cache WHERE prompt_hash = ?", (key,)).fetchone()
+    if row and os.path.exists(row[1]):
+        return row[0], row[1]
+
+    # Concurrent stories with the same instructions share one generation
+    task = DALLE_IN_FLIGHT.get(key)
+    if task is None:
+        task = asyncio.ensure_future(generate_cached_dalle_image(client, text, key, image_dir, cursor))
+        DALLE_IN_FLIGHT[key] = task
+        task.add_done_callback(lambda _: DALLE_IN_FLIGHT.pop(key, None))
+    return await asyncio.shield(task)
+
+async def generate_cached_dalle_image(client, text, key, image_dir, cursor):
+    """
+    Generate a DALL-E image, keep a local copy and record it in the image cache.
+
+    Parameters:
+    client (AsyncOpenAI): The OpenAI client instance.
+    text (str): The text prompt to be used for generating the image.
+    key (str): The image cache key for the text.
+    image_dir (Path): The directory cached images are downloaded to.
+    cursor (sqlite3.Cursor): The database cursor for the image cache.
+
+    Returns:
+    tuple: The image URL and the path of the local copy, or (None, None) if no image was created.
+    """
+    image_url = await create_dalle_image(client, text)
+    if not image_url:
+        return None, None
+
+    # DALL-E URLs expire, so the cache keeps its own copy of the image. It is downloaded
+    # under a temporary name so the cached file is never seen half written
+    local_path = str(image_dir / f"{key}.png")
+    fd, download_path = tempfile.mkstemp(suffix=".part", dir=image_dir)
+    os.close(fd)
+    try:
+        await download_image(image_url, download_path)
+        os.replace(download_path, local_path)
+    except BaseException:
+        os.remove(download_path)
+        raise
+    with cursor.connection:
+        cursor.execute("""
+            INSERT OR REPLACE INTO dalle_cache (prompt_hash, url, local_path)
+            VALUES (?, ?, ?)
+        """, (key, image_url, local_path))
+    return image_url, local_path
+
 def save_to_database(cursor, story_info, chat_response, image_url):
     """
     Save story information and responses to an SQL database.
@@ -117,93 +530,514 @@ def save_to_database(cursor, story_info, chat_response, image_url):
     story_info (dict): The user's story preferences.
     chat_response (str): The response from ChatGPT.
     image_url (str): The URL of the generated image.
+
+    Returns:
+    int: The id of the new story.
     """
-    cursor.execute("""
+    row = cursor.execute("""
         INSERT INTO stories (story_type, setting, characters, chat_response, image_url)
         VALUES (?, ?, ?, ?, ?)
-    """, (story_info['story_type'], story_info['setting'], story_info['characters'], chat_response, image_url))
-
-def download_image(image_url, image_dir):
-    response = requests.get(image_url, stream=True)
-    response.raise_for_status()
-    with open(image_dir, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=8192): 
-            f.write(chunk)
-
-def main():
-    # File paths
-    file_path = "C:/Users/Denzi/Desktop/Git_Projects/StoryBook/Python/"
-    file_name = "data.json"
-    image_dir = "C:/Users/Denzi/Desktop/Git_Projects/StoryBook/Python/Images"
-    db_path = "C:/Users/Denzi/Desktop/Git_Projects/StoryBook/Python/story_data.db"
-
-    # Read configuration
-    data = read_json_file(file_path + file_name)
-    openai_api_key = data['KEY']
-    client = OpenAI(api_key=openai_api_key)
-
-    # Create/connect to database
+        RETURNING id
+    """, (story_info['story_type'], story_info['setting'], story_info['characters'], chat_response, image_url)).fetchone()
+    return row[0]
+
+def save_many(cursor, rows):
+    """
+    Save several stories with a single executemany call.
+
+    Parameters:
+    cursor (sqlite3.Cursor): The database cursor.
+    rows (list): Tuples of (story_type, setting, characters, chat_response, image_url).
+
+    Returns:
+    list: The ids of the new stories, in the order of rows.
+    """
+    # executemany cannot return rows, but the new rows take the ids directly above the
+    # current maximum, in insertion order. BEGIN IMMEDIATE takes the write lock before the
+    # maximum is read, so no other writer can insert in between
+    if not cursor.connection.in_transaction:
+        cursor.execute("BEGIN IMMEDIATE")
+    last_id = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM stories").fetchone()[0]
+    cursor.executemany("""
+        INSERT INTO stories (story_type, setting, characters, chat_response, image_url)
+        VALUES (?, ?, ?, ?, ?)
+    """, rows)
+    story_ids = [row[0] for row in cursor.execute("SELECT id FROM stories WHERE id > ? ORDER BY id", (last_id,))]
+    if len(story_ids) != len(rows):
+        raise sqlite3.DatabaseError(f"Expected {len(rows)} new stories, found {len(story_ids)}")
+    return story_ids
+
+def connect_database(db_path):
+    """
+    Open the story database, tune it for fast writes and create the tables if needed.
+
+    Parameters:
+    db_path (str or Path): The path to the SQLite database file.
+
+    Returns:
+    sqlite3.Connection: The open database connection.
+    """
     conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS stories (
-            id INTEGER PRIMARY KEY,
-            story_type TEXT,
-            setting TEXT,
-            characters TEXT,
-            chat_response TEXT,
-            image_url TEXT
-        )
+    # WAL with synchronous=NORMAL avoids an fsync on every commit
+    conn.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA busy_timeout=5000;
+        PRAGMA temp_store=MEMORY;
     """)
+    with conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS stories (
+                id INTEGER PRIMARY KEY,
+                story_type TEXT,
+                setting TEXT,
+                characters TEXT,
+                chat_response TEXT,
+                image_url TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS prompt_cache (
+                prompt_hash TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS story_template_cache (
+                story_type TEXT,
+                setting TEXT,
+                character_count INTEGER,
+                template TEXT,
+                PRIMARY KEY (story_type, setting, character_count)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS dalle_cache (
+                prompt_hash TEXT PRIMARY KEY,
+                url TEXT,
+                local_path TEXT
+            )
+        """)
+    return conn
 
-    # User input for story
-    story_info = {
-        "story_type": input("What kind of story do you want? "),
-        "setting": input("What is the setting of the story? "),
-        "characters": input("Who are the characters in the story? ")
-    }
-
-    # Combine inputs into a prompt
-    prompt = f"Craft a childs {story_info['story_type']} story set in {story_info['setting']} with characters {story_info['characters']}."
-
-    # Get ChatGPT response 
-    text_response = get_chatgpt_response(client, prompt)
-
-    # create a text prompt for dalle to generate an image from the chatgpt text_response
-    prompt = "Images should be child approperate." + f"Summarize this text {text_response}. Encapsulate the essence of the story with a response no more than 800 characters."
-    
-    # Truncate the prompt if exceeds max length
-    max_length = 800
-    if len(prompt) > max_length:
-        prompt = prompt[:max_length].rsplit(' ', 1)[0]  # Avoid cutting off mid-word
-    
-    prompt = prompt 
-
-    #create an image from the text response
-    image_prompt = get_chatgpt_response(client, prompt)
-
-     # Truncate text if necessary
+async def download_image(image_url, image_dir):
+    """
+    Download an image without blocking the event loop.
+
+    Parameters:
+    image_url (str): The URL of the image to download.
+    image_dir (str or Path): The file path the image is written to.
+    """
+    async with get_download_client().stream("GET", image_url) as response:
+        response.raise_for_status()
+        # Let the 1 MiB file buffer coalesce network-sized chunks into few write syscalls,
+        # instead of re-chunking in Python which copies every byte through an extra buffer
+        with open(image_dir, 'wb', buffering=DOWNLOAD_BUFFER_SIZE) as f:
+            async for chunk in response.aiter_bytes():
+                f.write(chunk)
+
+def build_story_prompt(story_info):
+    """
+    Combine the user's story preferences into the user message sent with STORY_SYSTEM_PROMPT.
+
+    Parameters:
+    story_info (dict): The user's story preferences.
+
+    Returns:
+    str: The story prompt.
+    """
+    return f"Story type: {story_info['story_type']}\nSetting: {story_info['setting']}\nCharacters: {story_info['characters']}"
+
+def build_summary_prompt(text_response, max_length=MAX_SUMMARY_INPUT):
+    """
+    Build the user message sent with SUMMARY_SYSTEM_PROMPT to summarize a story for image generation.
+
+    The story is bounded before it is sent, since the summary instructions already
+    live in the fixed system message and need no room in this prompt.
+
+    Parameters:
+    text_response (str): The story text from ChatGPT.
+    max_length (int): The maximum character length of the prompt.
+
+    Returns:
+    str: The summary prompt.
+    """
+    return truncate_text(text_response, max_length)
+
+async def prepare_illustration(client, story_info, text_response, image_dir, cache_cursor=None):
+    """
+    Summarize a story, illustrate it with DALL-E and fetch the image, without saving anything.
+
+    Parameters:
+    client (AsyncOpenAI): The OpenAI client instance.
+    story_info (dict): The user's story preferences.
+    text_response (str): The story text from ChatGPT.
+    image_dir (Path): The directory images are downloaded to.
+    cache_cursor (sqlite3.Cursor): The database cursor for the prompt and image caches, or None to bypass them.
+
+    Returns:
+    tuple: The story row, the image file and whether that file is a temporary download, or None if there is no image.
+    """
+    # The summary depends on the story and the image on the summary, so these stay sequential
+    image_prompt = await get_chatgpt_response(client, build_summary_prompt(text_response), cursor=cache_cursor,
+                                              system_prompt=SUMMARY_SYSTEM_PROMPT)
+
+    # Truncate text if necessary
     image_instructions = extract_image_instructions(image_prompt) if image_prompt else None
 
-    print("\n image text: " + image_instructions)
+    print(f"\n image text: {image_instructions}")
 
     # Create image and proceed as before
-    image_url = create_dalle_image(client, image_instructions) if image_instructions else None
+    image_url, cached_image_path = await get_dalle_image(client, image_instructions, image_dir, cache_cursor) if image_instructions else (None, None)
+    if not (text_response and image_url):
+        return None
+
+    row = (story_info['story_type'], story_info['setting'], story_info['characters'], text_response, image_url)
+    if cached_image_path:
+        return row, cached_image_path, False
 
+    # Fetch the image before any transaction is opened; the connection is shared between
+    # concurrent stories, so no transaction may stay open across an await
+    fd, download_path = tempfile.mkstemp(suffix=".part", dir=image_dir)
+    os.close(fd)
+    try:
+        await download_image(image_url, download_path)
+    except BaseException:
+        os.remove(download_path)
+        raise
+    return row, download_path, True
+
+def store_image(image_file, is_download, image_path):
+    """
+    Put a prepared image at its final path.
+
+    Parameters:
+    image_file (str): The downloaded or cached image.
+    is_download (bool): Whether image_file is a temporary download that can be moved.
+    image_path (Path): The final path of the image.
+    """
+    if is_download:
+        os.replace(image_file, image_path)
+    else:
+        shutil.copyfile(image_file, image_path)
+
+def unstore_image(image_file, is_download, image_path):
+    """
+    Undo store_image after its story row was rolled back, so the id can be reused safely.
+
+    Parameters:
+    image_file (str): The downloaded or cached image.
+    is_download (bool): Whether the image was moved from image_file rather than copied.
+    image_path (Path): The final path the image was put at.
+    """
+    if not os.path.exists(image_path):
+        return
+    if is_download and not os.path.exists(image_file):
+        os.replace(image_path, image_file)  # Keep the download for a retry
+    else:
+        os.remove(image_path)
+
+def save_illustration(conn, illustration, image_dir):
+    """
+    Save one prepared story and put its image in place.
+
+    Parameters:
+    conn (sqlite3.Connection): The database connection.
+    illustration (tuple): A result of prepare_illustration.
+    image_dir (Path): The directory images are saved to.
+
+    Returns:
+    int: The id of the new story.
+    """
+    row, image_file, is_download = illustration
+    story_info = {"story_type": row[0], "setting": row[1], "characters": row[2]}
+    with conn:
+        story_id = save_to_database(conn.cursor(), story_info, row[3], row[4])
+        image_path = image_dir / f"{story_id}.png"
+        try:
+            store_image(image_file, is_download, image_path)
+        except OSError:
+            unstore_image(image_file, is_download, image_path)  # Remove a partial copy
+            raise
+    return story_id
+
+def discard_downloads(illustrations):
+    """
+    Remove temporary downloads that were not moved into place.
+
+    Parameters:
+    illustrations (list): Results of prepare_illustration.
+    """
+    for _, image_file, is_download in illustrations:
+        if is_download and os.path.exists(image_file):
+            os.remove(image_file)
+
+def save_illustrations(conn, illustrations, image_dir):
+    """
+    Save prepared stories in one transaction and put their images in place.
+
+    The rows are only committed once every image is in place, so a failed copy leaves no orphan story.
+    If the group fails, the images already put in place are taken back and the stories are
+    retried one at a time, so one bad image does not lose the rest of the group.
+
+    Parameters:
+    conn (sqlite3.Connection): The database connection.
+    illustrations (list): Results of prepare_illustration.
+    image_dir (Path): The directory images are saved to.
+
+    Returns:
+    int: The number of stories saved.
+    """
+    stored = []
+    try:
+        try:
+            with conn:
+                story_ids = save_many(conn.cursor(), [row for row, _, _ in illustrations])
+                for story_id, (_, image_file, is_download) in zip(story_ids, illustrations):
+                    image_path = image_dir / f"{story_id}.png"
+                    stored.append((image_file, is_download, image_path))
+                    store_image(image_file, is_download, image_path)
+            return len(illustrations)
+        except (sqlite3.Error, OSError) as e:
+            print(f"Error in saving {len(illustrations)} stories, retrying one at a time: {e}")
+            for image_file, is_download, image_path in stored:
+                unstore_image(image_file, is_download, image_path)
+
+        saved = 0
+        for illustration in illustrations:
+            try:
+                save_illustration(conn, illustration, image_dir)
+                saved += 1
+            except (sqlite3.Error, OSError) as e:
+                print(f"Error in saving story: {e}")
+        return saved
+    finally:
+        discard_downloads(illustrations)
+
+async def illustrate_story(client, conn, story_info, text_response, image_dir, cache_cursor=None):
+    """
+    Summarize a story, illustrate it with DALL-E, save it and download the image.
+
+    Parameters:
+    client (AsyncOpenAI): The OpenAI client instance.
+    conn (sqlite3.Connection): The database connection.
+    story_info (dict): The user's story preferences.
+    text_response (str): The story text from ChatGPT.
+    image_dir (Path): The directory images are downloaded to.
+    cache_cursor (sqlite3.Cursor): The database cursor for the prompt and image caches, or None to bypass them.
+    """
+    illustration = await prepare_illustration(client, story_info, text_response, image_dir, cache_cursor)
+    if illustration is None:
+        return
 
     # Save to database and display results
-    if text_response and image_url:
-        save_to_database(cursor, story_info, text_response, image_url)
-        conn.commit()
+    image_url = illustration[0][-1]
+    try:
+        save_illustration(conn, illustration, image_dir)
+    finally:
+        discard_downloads([illustration])
+
+    print(f"\nChatGPT Response: {text_response}")
+    print(f"\nGenerated Image URL: {image_url}")
+
+async def process_story(client, conn, story_info, image_dir, cache_cursor=None):
+    """
+    Generate, illustrate and save a single story.
+
+    Parameters:
+    client (AsyncOpenAI): The OpenAI client instance.
+    conn (sqlite3.Connection): The database connection.
+    story_info (dict): The user's story preferences.
+    image_dir (Path): The directory images are downloaded to.
+    cache_cursor (sqlite3.Cursor): The database cursor for the prompt cache, or None to bypass it.
+    """
+    # Reuse a story skeleton for the same type and setting, only paying for the illustration
+    text_response = get_templated_story(cache_cursor, story_info) if cache_cursor is not None else None
+    if not text_response:
+        text_response = await get_chatgpt_response(client, build_story_prompt(story_info), cursor=cache_cursor,
+                                                   system_prompt=STORY_SYSTEM_PROMPT)
+        if text_response and cache_cursor is not None:
+            cache_story_template(cache_cursor, story_info, text_response)
+    if text_response:
+        await illustrate_story(client, conn, story_info, text_response, image_dir, cache_cursor)
+
+async def submit_batch(client, jobs, model=DEFAULT_MODEL):
+    """
+    Submit story prompts to the OpenAI Batch API.
+
+    Parameters:
+    client (AsyncOpenAI): The OpenAI client instance.
+    jobs (dict): Story prompts keyed by custom id.
+    model (str): The model to use for the chat completions.
+
+    Returns:
+    Batch: The created batch.
+    """
+    lines = [
+        json.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {"model": model, "messages": build_messages(prompt, STORY_SYSTEM_PROMPT)}
+        })
+        for custom_id, prompt in jobs.items()
+    ]
+    batch_file = await client.files.create(file=("stories.jsonl", "\n".join(lines).encode()), purpose="batch")
+    return await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+
+async def wait_for_batch(client, batch_id, initial_delay=5, max_delay=300):
+    """
+    Poll a batch with exponential backoff until it stops running.
+
+    Parameters:
+    client (AsyncOpenAI): The OpenAI client instance.
+    batch_id (str): The id of the batch to poll.
+    initial_delay (float): Seconds to wait before the first poll.
+    max_delay (float): Upper bound on the wait between polls.
+
+    Returns:
+    Batch: The batch in its final state.
+    """
+    delay = initial_delay
+    while True:
+        await asyncio.sleep(delay)
+        batch = await client.batches.retrieve(batch_id)
+        if batch.status in ("completed", "failed", "expired", "cancelled"):
+            return batch
+        delay = min(delay * 2, max_delay)
+
+async def read_batch_output(client, batch):
+    """
+    Download a finished batch's output and error files and extract the response text.
+
+    Parameters:
+    client (AsyncOpenAI): The OpenAI client instance.
+    batch (Batch): The finished batch.
+
+    Returns:
+    dict: Response text keyed by custom id; failed requests are reported and left out.
+    """
+    responses = {}
+    # Successful requests are in the output file, requests that failed in the error file
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        content = await client.files.content(file_id)
+        for line in content.text.splitlines():
+            result = json.loads(line)
+            response = result.get("response")
+            if result.get("error") or not response or response["status_code"] != 200:
+                error = result.get("error") or (response or {}).get("body", {}).get("error")
+                print(f"Error in batch request {result['custom_id']}: {error}")
+                continue
+            responses[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+    return responses
+
+async def process_batch(client, conn, stories, image_dir, cache_cursor=None, model=DEFAULT_MODEL):
+    """
+    Generate many stories through the Batch API, then illustrate them concurrently.
+
+    Parameters:
+    client (AsyncOpenAI): The OpenAI client instance.
+    conn (sqlite3.Connection): The database connection.
+    stories (list): The story preferences to generate.
+    image_dir (Path): The directory images are downloaded to.
+    cache_cursor (sqlite3.Cursor): The database cursor for the prompt cache, or None to bypass it.
+    model (str): The model to use for the chat completions.
+    """
+    stories_by_id = {f"story-{index}": story_info for index, story_info in enumerate(stories)}
+    prompts = {custom_id: build_story_prompt(story_info) for custom_id, story_info in stories_by_id.items()}
+
+    # Only send the prompts that are not already cached
+    text_responses = {}
+    if cache_cursor is not None:
+        for custom_id, prompt in prompts.items():
+            cached = get_templated_story(cache_cursor, stories_by_id[custom_id]) or get_cached_response(cache_cursor, model, prompt, STORY_SYSTEM_PROMPT)
+            if cached:
+                text_responses[custom_id] = cached
+    jobs = {custom_id: prompt for custom_id, prompt in prompts.items() if custom_id not in text_responses}
+
+    if jobs:
+        batch = await submit_batch(client, jobs, model)
+        batch = await wait_for_batch(client, batch.id)
+        if batch.status != "completed":
+            print(f"Batch {batch.id} ended with status {batch.status}")
+        batch_responses = await read_batch_output(client, batch)
+        if cache_cursor is not None:
+            for custom_id, text_response in batch_responses.items():
+                cache_response(cache_cursor, model, jobs[custom_id], text_response, STORY_SYSTEM_PROMPT)
+                cache_story_template(cache_cursor, stories_by_id[custom_id], text_response)
+        text_responses.update(batch_responses)
+
+    # Fan the illustration stage out; the semaphore keeps OpenAI concurrency in check
+    tasks = [
+        asyncio.ensure_future(prepare_illustration(client, stories_by_id[custom_id], text_response, image_dir, cache_cursor))
+        for custom_id, text_response in text_responses.items()
+    ]
+
+    # Save finished stories in groups so each transaction covers many rows
+    illustrations = []
+    saved = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                illustration = await next_done
+            except Exception as e:
+                print(f"Error in illustrating story: {e}")
+                continue
+            if illustration is None:
+                continue
+            illustrations.append(illustration)
+            if len(illustrations) >= SAVE_BATCH_SIZE:
+                saved += save_illustrations(conn, illustrations, image_dir)
+                illustrations = []
+        if illustrations:
+            saved += save_illustrations(conn, illustrations, image_dir)
+    finally:
+        # If the loop is interrupted, stop the remaining stories and remove their unsaved downloads;
+        # downloads that were saved have already been moved into place
+        for task in tasks:
+            task.cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        discard_downloads([result for result in results if isinstance(result, tuple)])
+    print(f"\nSaved {saved} of {len(stories)} stories")
+
+async def main():
+    parser = argparse.ArgumentParser(description="Generate a children's story and illustration.")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the ChatGPT response, story template and DALL-E image caches.")
+    parser.add_argument("--batch", metavar="FILE", help="JSON file with a list of stories to generate through the Batch API.")
+    args = parser.parse_args()
+
+    IMAGE_DIR.mkdir(exist_ok=True)
+
+    # Read configuration, falling back to data.json when the key is not in the environment
+    openai_api_key = os.environ.get("OPENAI_API_KEY") or read_json_file(CONFIG_PATH)['KEY']
 
-        print(f"\nChatGPT Response: {text_response}")
-        print(f"\nGenerated Image URL: {image_url}")
+    if args.batch:
+        stories = read_json_file(args.batch)
+    else:
+        # User input for story
+        story_info = {
+            "story_type": input("What kind of story do you want? "),
+            "setting": input("What is the setting of the story? "),
+            "characters": input("Who are the characters in the story? ")
+        }
 
-        image_path = f"{image_dir}/{cursor.lastrowid}.png"
-        download_image(image_url, image_path)
+    # Create/connect to database and the shared download pool
+    async with get_download_client():
+        with closing(connect_database(DB_PATH)) as conn:
+            cache_cursor = None if args.no_cache else conn.cursor()
 
-    # Close database connection
-    conn.close()
+            async with create_openai_client(openai_api_key) as client:
+                if args.batch:
+                    await process_batch(client, conn, stories, IMAGE_DIR, cache_cursor)
+                else:
+                    await process_story(client, conn, story_info, IMAGE_DIR, cache_cursor)
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -0,0 +1,59 @@
+"""
+Tests for the story template cache in test.py.
+
+Run from this directory with: python -m unittest test_story_templates
+"""
+
+import importlib.util
+import sqlite3
+import unittest
+from pathlib import Path
+
+# test.py shares its name with the standard library's test package, so load it by path
+spec = importlib.util.spec_from_file_location("storybook", Path(__file__).with_name("test.py"))
+storybook = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(storybook)
+
+class StoryTemplateCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("""
+            CREATE TABLE story_template_cache (
+                story_type TEXT,
+                setting TEXT,
+                character_count INTEGER,
+                template TEXT,
+                PRIMARY KEY (story_type, setting, character_count)
+            )
+        """)
+        self.cursor = self.conn.cursor()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def story(self, characters):
+        return {"story_type": "fairy tale", "setting": "a pond", "characters": characters}
+
+    def test_proper_names_are_substituted(self):
+        storybook.cache_story_template(self.cursor, self.story("Alice and Bob"),
+                                       "Alice met Bob at the pond. Bob's boat sank and Alice laughed.")
+        self.assertEqual(storybook.get_templated_story(self.cursor, self.story("Carol, Dan")),
+                         "Carol met Dan at the pond. Dan's boat sank and Carol laughed.")
+
+    def test_descriptive_characters_are_not_cached(self):
+        storybook.cache_story_template(self.cursor, self.story("a princess and a frog"),
+                                       "Once there was a princess who met a frog. The princess kissed the frog.")
+        self.assertIsNone(storybook.get_templated_story(self.cursor, self.story("a robot and a cat")))
+        self.assertIsNone(storybook.get_templated_story(self.cursor, self.story("Robo and Tom")))
+
+    def test_names_mentioned_in_another_form_are_not_cached(self):
+        storybook.cache_story_template(self.cursor, self.story("Captain Hook, Wendy"),
+                                       "Captain Hook chased Wendy. Hook fell in the pond.")
+        self.assertIsNone(storybook.get_templated_story(self.cursor, self.story("Peter Pan, Tink")))
+
+    def test_descriptive_request_does_not_use_cached_template(self):
+        storybook.cache_story_template(self.cursor, self.story("Alice and Bob"), "Alice met Bob.")
+        self.assertIsNone(storybook.get_templated_story(self.cursor, self.story("a robot and a cat")))
+
+if __name__ == "__main__":
+    unittest.main()